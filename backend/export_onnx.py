@@ -0,0 +1,41 @@
+"""
+Build the serving artifacts used by main.py.
+
+    python export_onnx.py
+
+Writes the fast tokenizer's tokenizer.json into emotion_model_final/ if it
+is missing, an FP32 export to emotion_model_onnx/ and a dynamically
+quantized INT8 copy (avx512_vnni config) to emotion_model_onnx_int8/.
+Requires optimum[onnxruntime].
+"""
+
+from pathlib import Path
+
+from transformers import AutoTokenizer
+from optimum.onnxruntime import ORTModelForSequenceClassification, ORTQuantizer
+from optimum.onnxruntime.configuration import AutoQuantizationConfig
+
+
+BASE_DIR = Path(__file__).resolve().parent
+MODEL_DIR = BASE_DIR / "emotion_model_final"
+ONNX_DIR = BASE_DIR / "emotion_model_onnx"
+ONNX_INT8_DIR = BASE_DIR / "emotion_model_onnx_int8"
+
+
+def main():
+    # ---------- Fast tokenizer ----------
+    if not (MODEL_DIR / "tokenizer.json").exists():
+        AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=True).save_pretrained(MODEL_DIR)
+
+    # ---------- FP32 export ----------
+    model = ORTModelForSequenceClassification.from_pretrained(MODEL_DIR, export=True)
+    model.save_pretrained(ONNX_DIR)
+
+    # ---------- Dynamic INT8 quantization ----------
+    quantizer = ORTQuantizer.from_pretrained(ONNX_DIR)
+    qconfig = AutoQuantizationConfig.avx512_vnni(is_static=False, per_channel=False)
+    quantizer.quantize(save_dir=ONNX_INT8_DIR, quantization_config=qconfig)
+
+
+if __name__ == "__main__":
+    main()
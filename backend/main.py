@@ -1,18 +1,37 @@
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
+from cachetools import TTLCache
+from hashlib import blake2b
+from functools import lru_cache
 from transformers import AutoTokenizer, AutoModelForSequenceClassification
 import torch
-import numpy as np
 import re
 import os
+import threading
+import logging
+import contextlib
+import asyncio
+import anyio.to_thread
 from openai import OpenAI
 
+try:
+    from onnxruntime import GraphOptimizationLevel, SessionOptions
+    from optimum.onnxruntime import ORTModelForSequenceClassification
+except ImportError:  # optimum[onnxruntime] is optional; fall back to PyTorch
+    ORTModelForSequenceClassification = None
+
 
 load_dotenv()
 
+# let the Rust tokenizer encode a batch of sentences on several threads
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+logger = logging.getLogger(__name__)
+
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
 # -------------------------------------------------------------
@@ -23,6 +42,7 @@ app = FastAPI(
     title="Stress & Emotion Detector",
     description="API that predicts emotion and stress level from journal text.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 origins = [
@@ -46,13 +66,41 @@ class JournalInput(BaseModel):
     text: str
 
 
+# documents the /predict response only; it is not validated per request
+class SentenceResult(BaseModel):
+    sentence: str
+    emotion: str
+    stress_level: str
+    stress_score: float
+    scores: dict[str, float]
+
+
+class PredictResponse(BaseModel):
+    primary_emotion: str
+    stress_level: str
+    stress_score: float
+    scores: dict[str, float]
+    coping_strategy: str
+    sentence_breakdown: list[SentenceResult]
+
+
 # -------------------------------------------------------------
 # SIMPLE SENTENCE SPLITTER (no nltk needed)
 # -------------------------------------------------------------
 
+# compiled once; splits on whitespace that follows . ! or ?
+SENTENCE_BOUNDARY_RE = re.compile(r'(?<=[.!?])\s+')
+
+
 def simple_sentence_split(text: str):
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    return [s.strip() for s in sentences if s.strip()]
+    return [s for s in map(str.strip, SENTENCE_BOUNDARY_RE.split(text)) if s]
+
+
+# input caps for /predict; the model only reads the first MAX_LENGTH tokens
+# anyway, so longer input only adds tokenizer work
+MAX_TEXT_CHARS = 16384
+MAX_SENTENCE_CHARS = 1024
+MAX_SENTENCES = 64
 
 
 # -------------------------------------------------------------
@@ -62,6 +110,14 @@ def simple_sentence_split(text: str):
 
 emotion_labels = ["sadness", "joy", "love", "anger", "fear", "surprise"]
 
+# stress heuristic: fear + anger + 0.5 * sadness, as a weight per label
+STRESS_EMOTION_WEIGHTS = {"fear": 1.0, "anger": 1.0, "sadness": 0.5}
+STRESS_WEIGHTS = torch.tensor([STRESS_EMOTION_WEIGHTS.get(label, 0.0) for label in emotion_labels])
+
+# stress_score < 0.3 -> low, < 0.6 -> medium, else high (bucketize index)
+STRESS_THRESHOLDS = torch.tensor([0.3, 0.6])
+STRESS_LEVELS = ("low", "medium", "high")
+
 # -------------------------------------------------------------
 # COPING STRATEGIES
 # -------------------------------------------------------------
@@ -90,9 +146,17 @@ COPING_STRATEGIES = {
     }
 }
 
+# flattened once at import: (stress_level, emotion) -> strategy, plus per-level defaults
+COPING_FLAT = {
+    (level, emotion): strategy
+    for level, strategies in COPING_STRATEGIES.items()
+    for emotion, strategy in strategies.items()
+    if emotion != "default"
+}
+COPING_DEFAULT = {level: strategies["default"] for level, strategies in COPING_STRATEGIES.items()}
+
 def get_coping_strategy(stress_level: str, emotion: str) -> str:
-    level = COPING_STRATEGIES.get(stress_level, {})
-    return level.get(emotion, level.get("default", "Take a deep breath."))
+    return COPING_FLAT.get((stress_level, emotion)) or COPING_DEFAULT.get(stress_level, "Take a deep breath.")
 
 
 # -------------------------------------------------------------
@@ -102,50 +166,398 @@ def get_coping_strategy(stress_level: str, emotion: str) -> str:
 BASE_DIR = Path(__file__).resolve().parent
 MODEL_DIR = BASE_DIR / "emotion_model_final"
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR)
-model = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR)
-model.eval()
+# built by export_onnx.py
+ONNX_DIR = BASE_DIR / "emotion_model_onnx"
+ONNX_INT8_DIR = BASE_DIR / "emotion_model_onnx_int8"
+
+if torch.cuda.is_available():
+    DEVICE = "cuda"
+elif torch.backends.mps.is_available():
+    DEVICE = "mps"
+else:
+    DEVICE = "cpu"
+
+# split the cores between uvicorn/gunicorn workers instead of letting
+# every worker start one thread per core
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+NUM_THREADS = max(1, (os.cpu_count() or 1) // WORKERS)
+
+# COMPILE=1 wraps the PyTorch model in torch.compile (slower startup)
+COMPILE = os.getenv("COMPILE") == "1"
+
+# forward-pass shapes (see run_model)
+MAX_LENGTH = 512  # tokenizer model_max_length: long entries truncate as before
+SEQ_BUCKET = 32   # rows are padded up to a multiple of this
+MAX_BATCH = 64    # rows per forward pass
+
+
+def cpu_has_flag(flag: str) -> bool:
+    """Check /proc/cpuinfo for a CPU feature flag (False when unavailable)."""
+    try:
+        return flag in Path("/proc/cpuinfo").read_text().split()
+    except OSError:
+        return False
+
+
+# reduced-precision forward: FP16 on CUDA, BF16 only on CPUs with native
+# bf16 support (AMX / AVX512-BF16) where it is actually faster than FP32
+if DEVICE == "cuda":
+    AUTOCAST_DTYPE = torch.float16
+elif DEVICE == "cpu" and (cpu_has_flag("amx_bf16") or cpu_has_flag("avx512_bf16")):
+    AUTOCAST_DTYPE = torch.bfloat16
+else:
+    AUTOCAST_DTYPE = None
+
+# canned inputs for the startup FP32-vs-autocast check
+PARITY_SENTENCES = [
+    "Today was a wonderful day and I feel great.",
+    "I am so angry that nobody listened to me.",
+    "I'm scared about the exam tomorrow.",
+    "I miss my family and feel really alone.",
+]
+
+
+def load_model():
+    """Load the ONNX Runtime export when available, else the PyTorch model.
 
+    ONNX Runtime is only used for CPU serving. The INT8 export is only used
+    on CPUs with avx512_vnni; older CPUs run dynamic INT8 slower than FP32,
+    so they get the FP32 ONNX model instead.
+    """
+    if ORTModelForSequenceClassification is not None and DEVICE == "cpu":
+        if ONNX_INT8_DIR.exists() and cpu_has_flag("avx512_vnni"):
+            onnx_dir, file_name = ONNX_INT8_DIR, "model_quantized.onnx"
+        else:
+            onnx_dir, file_name = ONNX_DIR, "model.onnx"
+
+        if onnx_dir.exists():
+            options = SessionOptions()
+            options.graph_optimization_level = GraphOptimizationLevel.ORT_ENABLE_ALL
+            options.intra_op_num_threads = NUM_THREADS
+            return ORTModelForSequenceClassification.from_pretrained(
+                onnx_dir, file_name=file_name, session_options=options
+            )
+
+    model = AutoModelForSequenceClassification.from_pretrained(MODEL_DIR)
+    # logits only: no hidden states / attentions, plain tuple outputs
+    model.config.output_hidden_states = False
+    model.config.output_attentions = False
+    model.config.return_dict = False
+    return model.to(DEVICE).eval()
+
+
+def configure_torch_threads():
+    """CPU inference: oneDNN kernels, one intra-op pool per worker."""
+    torch.backends.mkldnn.enabled = True
+    torch.set_num_threads(NUM_THREADS)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # already set, or inter-op work has started (e.g. the module was
+        # imported both as `main` and `backend.main`); keep what's there
+        pass
+
+
+def precision_context(autocast_dtype):
+    """Autocast to `autocast_dtype`, or a no-op when running in FP32."""
+    if autocast_dtype is None:
+        return contextlib.nullcontext()
+    return torch.autocast(device_type=DEVICE, dtype=autocast_dtype)
+
+
+def parity_predictions(tokenizer, model, autocast_dtype):
+    """Argmax emotion index for each of PARITY_SENTENCES."""
+    inputs = tokenizer(PARITY_SENTENCES, return_tensors="pt", padding=True).to(DEVICE)
+    with torch.inference_mode(), precision_context(autocast_dtype):
+        logits = model(input_ids=inputs["input_ids"], attention_mask=inputs["attention_mask"])[0]
+    return logits.argmax(dim=-1)
+
+
+@lru_cache(maxsize=1)
+def get_model():
+    """Load the tokenizer + model once per process and share them.
+
+    Returns (tokenizer, model, autocast_dtype); autocast_dtype is None when
+    the model runs in FP32 (ONNX Runtime, MPS, older CPUs, failed parity).
+    """
+    configure_torch_threads()
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_DIR, use_fast=True)
+    if not tokenizer.is_fast:
+        raise RuntimeError(
+            "the fast tokenizer is required: install `tokenizers` and run "
+            "export_onnx.py to write tokenizer.json"
+        )
+
+    model = load_model()
+
+    autocast_dtype = None
+    if isinstance(model, torch.nn.Module) and AUTOCAST_DTYPE is not None:
+        reference = parity_predictions(tokenizer, model, None)
+        if DEVICE == "cuda":
+            # keep FP16 weights so autocast doesn't recast them per call
+            model = model.half()
+
+        # check the model exactly as it will be served against FP32
+        if torch.equal(reference, parity_predictions(tokenizer, model, AUTOCAST_DTYPE)):
+            autocast_dtype = AUTOCAST_DTYPE
+        else:
+            logger.warning("%s autocast changed predictions; serving in FP32", AUTOCAST_DTYPE)
+            model = model.float()
+
+    if COMPILE and isinstance(model, torch.nn.Module):
+        # run_model() sends 1..MAX_BATCH rows at any SEQ_BUCKET length, so
+        # compile one graph with dynamic batch/sequence dims instead of one
+        # per shape. Default mode, not reduce-overhead: CUDA graphs would
+        # still be recorded per shape (and per serving thread)
+        model = torch.compile(model, dynamic=True)
+
+        # trigger compilation now rather than on the first request: one
+        # single-row pass (size-1 dims get their own specialization) and
+        # one multi-row pass for the general dynamic graph
+        with torch.inference_mode(), precision_context(autocast_dtype):
+            for rows, seq_len in ((1, SEQ_BUCKET), (2, 2 * SEQ_BUCKET)):
+                warmup = tokenizer(
+                    ["warmup"] * rows, padding="max_length", max_length=seq_len, return_tensors="pt"
+                ).to(DEVICE)
+                model(input_ids=warmup["input_ids"], attention_mask=warmup["attention_mask"])
+
+    return tokenizer, model, autocast_dtype
+
+
+# -------------------------------------------------------------
+# BATCHED FORWARD PASS
+# -------------------------------------------------------------
+
+@lru_cache(maxsize=1)
+def get_input_buffers():
+    """Flat (input_ids, attention_mask) staging buffers for CUDA/MPS.
+
+    Returns a host buffer (pinned on CUDA) and the device buffer it is
+    copied into; one flat tensor each, so every [2, rows, seq_len] chunk
+    is a dense prefix and moves with a single memcpy. Not used on CPU,
+    where the padded batch tensor is fed to the model directly.
+    """
+    host = torch.zeros(2 * MAX_BATCH * MAX_LENGTH, dtype=torch.long, pin_memory=DEVICE == "cuda")
+    return host, torch.zeros_like(host, device=DEVICE)
+
+
+# the staging buffers are shared and one forward already uses every
+# intra-op thread, so forward passes run one at a time
+_forward_lock = threading.Lock()
+
+
+def run_model(texts):
+    """Return [len(texts), num_labels] logits, one forward pass per length bucket.
+
+    Rows are grouped by token length rounded up to SEQ_BUCKET, so short
+    sentences aren't padded to the length of the whole entry and the model
+    only ever sees a handful of input shapes.
+    """
+    tokenizer, model, autocast_dtype = get_model()
+    encoded = tokenizer(texts, truncation=True, max_length=MAX_LENGTH)["input_ids"]
+    pad_id = tokenizer.pad_token_id
+
+    buckets = {}
+    for row, ids in enumerate(encoded):
+        seq_len = -(-len(ids) // SEQ_BUCKET) * SEQ_BUCKET
+        buckets.setdefault(seq_len, []).append(row)
+
+    with _forward_lock, torch.inference_mode(), precision_context(autocast_dtype):
+        logits = torch.empty(len(texts), len(emotion_labels), device=DEVICE)
+        copied = None  # CUDA event for the last async host -> device copy
+
+        for seq_len, rows in buckets.items():
+            for start in range(0, len(rows), MAX_BATCH):
+                chunk = rows[start:start + MAX_BATCH]
+                shape = (2, len(chunk), seq_len)
+                size = 2 * len(chunk) * seq_len
+
+                # pad the whole chunk in Python, then build one tensor
+                padded = [
+                    [encoded[row] + [pad_id] * (seq_len - len(encoded[row])) for row in chunk],
+                    [[1] * len(encoded[row]) + [0] * (seq_len - len(encoded[row])) for row in chunk],
+                ]
+                batch = torch.tensor(padded)
+
+                if DEVICE == "cpu":
+                    inputs = batch
+                else:
+                    host, device = get_input_buffers()
+                    if copied is not None:
+                        # the previous chunk may still be reading the pinned buffer
+                        copied.synchronize()
+                    host[:size].view(shape).copy_(batch)
+                    device[:size].copy_(host[:size], non_blocking=True)
+                    if DEVICE == "cuda":
+                        copied = torch.cuda.Event()
+                        copied.record()
+                    inputs = device[:size].view(shape)
+
+                # [0] is the logits for both the tuple (PyTorch) and
+                # ModelOutput (ONNX Runtime) return types
+                outputs = model(input_ids=inputs[0], attention_mask=inputs[1])
+                logits[chunk] = outputs[0].float()
+
+        if copied is not None:
+            copied.synchronize()
+
+    return logits
 
 # -------------------------------------------------------------
 # HELPER: compute emotion + stress from logits
 # -------------------------------------------------------------
 
+@lru_cache(maxsize=None)
+def stress_tensors(device: torch.device):
+    """STRESS_WEIGHTS and STRESS_THRESHOLDS, copied to `device` once."""
+    return STRESS_WEIGHTS.to(device), STRESS_THRESHOLDS.to(device)
+
+
 def compute_emotion_and_stress(logits: torch.Tensor):
-    """Compute emotion + derived stress levels from logits."""
-    probs = torch.softmax(logits, dim=-1).cpu().numpy()
+    """Compute emotion + derived stress levels for a [N, num_labels] batch of logits.
 
-    emotion_idx = int(probs.argmax())
-    emotion = emotion_labels[emotion_idx]
+    Returns one (emotion, probs, stress_level, stress_score) tuple per row.
+    All reductions run on the logits' device and the results come back to
+    the host in a single copy.
+    """
+    weights, thresholds = stress_tensors(logits.device)
 
-    # build dict scores
-    scores = {
-        emotion_labels[i]: float(p)
-        for i, p in enumerate(probs)
-    }
+    probs = logits.float().softmax(dim=-1)
 
-    # stress heuristic
-    stress_score = (
-        scores.get("fear", 0)
-        + scores.get("anger", 0)
-        + 0.5 * scores.get("sadness", 0)
-    )
-    stress_score = max(0.0, min(1.0, stress_score))
+    emotion_idx = probs.argmax(dim=-1)
+
+    stress_scores = (probs @ weights).clamp(0.0, 1.0)
+
+    # index into STRESS_LEVELS
+    level_idx = torch.bucketize(stress_scores, thresholds, right=True)
+
+    # [probs..., stress_score, emotion_idx, level_idx] per row; the only sync
+    packed = torch.cat([
+        probs,
+        stress_scores[:, None],
+        emotion_idx[:, None].float(),
+        level_idx[:, None].float(),
+    ], dim=-1).tolist()
+
+    return [
+        (emotion_labels[int(row[-2])], row[:-3], STRESS_LEVELS[int(row[-1])], row[-3])
+        for row in packed
+    ]
+
+
+# -------------------------------------------------------------
+# RESPONSE CACHE (identical journal text -> same prediction)
+# -------------------------------------------------------------
+
+# only touched from the event loop, so no lock is needed
+_cache = TTLCache(maxsize=4096, ttl=3600)
+
+
+def cache_key(text: str) -> bytes:
+    return blake2b(text.encode("utf-8"), digest_size=16).digest()
 
-    if stress_score < 0.3:
-        stress_level = "low"
-    elif stress_score < 0.6:
-        stress_level = "medium"
-    else:
-        stress_level = "high"
 
-    return emotion, scores, stress_level, stress_score
+# -------------------------------------------------------------
+# MICRO-BATCHER (one forward pass for concurrent /predict calls)
+# -------------------------------------------------------------
+
+BATCH_WINDOW = 0.005   # seconds to wait for more requests to join a batch
+MAX_PENDING = 16       # requests per batch
+
+_pending = None        # asyncio.Queue of (texts, future)
+_batch_task = None
+
+
+def score_texts(texts):
+    """Run the model over `texts` and return one result tuple per text."""
+    return compute_emotion_and_stress(run_model(texts))
+
+
+def fail_futures(batch, exc):
+    """Resolve every still-pending future in `batch` with `exc`."""
+    for _, future in batch:
+        if not future.done():
+            future.set_exception(exc)
+
+
+async def batch_worker(queue):
+    """Collect queued requests for up to BATCH_WINDOW, score them together,
+    and hand each request its own slice of the results."""
+    loop = asyncio.get_running_loop()
+    batch = []
+
+    try:
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + BATCH_WINDOW
+            while len(batch) < MAX_PENDING:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            rows = [text for texts, _ in batch for text in texts]
+            try:
+                # keep the event loop free while the model runs
+                results = await anyio.to_thread.run_sync(score_texts, rows)
+            except Exception as exc:
+                fail_futures(batch, exc)
+                continue
+
+            start = 0
+            for texts, future in batch:
+                if not future.done():
+                    future.set_result(results[start:start + len(texts)])
+                start += len(texts)
+    except asyncio.CancelledError:
+        # don't leave the requests of an in-flight batch hanging
+        fail_futures(batch, RuntimeError("prediction worker stopped"))
+        raise
+
+
+def ensure_batch_worker():
+    """Start the queue + batch worker on the running event loop if needed.
+
+    Normally done by the startup hook; this also covers callers that skip
+    lifespan events (e.g. TestClient used without `with`) and a worker
+    left behind on a loop that has since been replaced.
+    """
+    global _pending, _batch_task
+    loop = asyncio.get_running_loop()
+    if _batch_task is None or _batch_task.done() or _batch_task.get_loop() is not loop:
+        _pending = asyncio.Queue()
+        _batch_task = loop.create_task(batch_worker(_pending))
 
 
 # -------------------------------------------------------------
 # ROUTES
 # -------------------------------------------------------------
 
+@app.on_event("startup")
+def load_model_on_startup():
+    # load weights before serving so the first request doesn't pay for it
+    get_model()
+
+@app.on_event("startup")
+async def start_batch_worker():
+    ensure_batch_worker()
+
+@app.on_event("shutdown")
+async def stop_batch_worker():
+    if _batch_task is not None:
+        _batch_task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await _batch_task
+
+    # requests still queued would otherwise wait forever
+    if _pending is not None:
+        while not _pending.empty():
+            fail_futures([_pending.get_nowait()], RuntimeError("prediction worker stopped"))
+
 @app.get("/")
 def root():
     return {"message": "Stress-burnout detector API is running"}
@@ -154,42 +566,48 @@ def root():
 def health_check():
     return {"status": "ok"}
 
-@app.post("/predict")
-def predict(input: JournalInput):
+@app.post("/predict", responses={200: {"model": PredictResponse}})
+async def predict(input: JournalInput):
 
-    text = input.text.strip()
+    text = input.text.strip()[:MAX_TEXT_CHARS]
 
-    # ---------- Sentence-level breakdown ----------
-    sentences = simple_sentence_split(text)
-    sentence_results = []
+    key = cache_key(text)
+    cached = _cache.get(key)
+    if cached is not None:
+        return ORJSONResponse(cached)
+
+    sentences = [s[:MAX_SENTENCE_CHARS] for s in simple_sentence_split(text)][:MAX_SENTENCES]
 
-    for sent in sentences:
-        inputs = tokenizer(sent, return_tensors="pt", truncation=True)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits[0]
+    # ---------- Batched forward pass ----------
+    # every sentence plus the whole text (last row) are scored together,
+    # alongside any other requests that arrive within the batch window;
+    # a single-sentence entry is its own whole text, so it's scored once
+    texts = sentences if sentences == [text] else sentences + [text]
 
-        emotion, scores, stress_level, stress_score = compute_emotion_and_stress(logits)
+    ensure_batch_worker()
+    future = asyncio.get_running_loop().create_future()
+    await _pending.put((texts, future))
+    results = await future
+
+    # ---------- Sentence-level breakdown ----------
+    sentence_results = []
 
+    for sent, (emotion, probs, stress_level, stress_score) in zip(sentences, results):
         sentence_results.append({
             "sentence": sent,
             "emotion": emotion,
             "stress_level": stress_level,
             "stress_score": stress_score,
-            "scores": scores,
+            "scores": dict(zip(emotion_labels, probs)),
         })
 
     # ---------- Whole-text prediction ----------
-    inputs = tokenizer(text, return_tensors="pt", truncation=True)
-    with torch.no_grad():
-        outputs = model(**inputs)
-        logits = outputs.logits[0]
-
-    full_emotion, full_scores, full_stress_level, full_stress_score = compute_emotion_and_stress(logits)
+    full_emotion, full_probs, full_stress_level, full_stress_score = results[-1]
+    full_scores = dict(zip(emotion_labels, full_probs))
 
     coping = get_coping_strategy(full_stress_level, full_emotion)
 
-    return {
+    response = {
         "primary_emotion": full_emotion,
         "stress_level": full_stress_level,
         "stress_score": full_stress_score,
@@ -198,6 +616,11 @@ def predict(input: JournalInput):
         "sentence_breakdown": sentence_results,
     }
 
+    _cache[key] = response
+
+    # returning a Response skips FastAPI's jsonable_encoder pass over the dict
+    return ORJSONResponse(response)
+
 # -------------------------------------------------------------
 
 class CopingRequest(BaseModel):